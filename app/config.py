@@ -45,5 +45,25 @@ class CeleryConfig:
         )
         return celery_app
 
+class ResilienceConfig:
+    REDIS_URL: str = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RECOVERY_TIMEOUT: int = int(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", "60"))  # seconds
+    STAGE_MAX_RETRIES: int = int(os.getenv("STAGE_MAX_RETRIES", "5"))
+    RETRY_BACKOFF_BASE: int = int(os.getenv("RETRY_BACKOFF_BASE", "10"))  # seconds
+    RETRY_BACKOFF_MAX: int = int(os.getenv("RETRY_BACKOFF_MAX", "600"))  # seconds
+    DRAIN_INTERVAL: float = float(os.getenv("DRAIN_INTERVAL", "30"))  # seconds
+    DRAIN_BATCH_SIZE: int = int(os.getenv("DRAIN_BATCH_SIZE", "50"))
+    # Calls only show up in Bitrix once they end, so each fetch looks back by the longest expected call
+    CALL_FETCH_OVERLAP: int = int(os.getenv("CALL_FETCH_OVERLAP", "7200"))  # seconds
+    CALL_DEDUPE_TTL: int = int(os.getenv("CALL_DEDUPE_TTL", str(7 * 24 * 3600)))  # seconds
+    # Provider request timeouts in seconds
+    BITRIX_TIMEOUT: float = float(os.getenv("BITRIX_TIMEOUT", "30"))
+    RECORDINGS_TIMEOUT: float = float(os.getenv("RECORDINGS_TIMEOUT", "60"))
+    WHISPER_TIMEOUT: float = float(os.getenv("WHISPER_TIMEOUT", "300"))
+    OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "300"))
+    SHEETS_TIMEOUT: float = float(os.getenv("SHEETS_TIMEOUT", "60"))
+
 celery_config = CeleryConfig()
 backend_config = BackendConfig()
+resilience_config = ResilienceConfig()
@@ -1,10 +1,15 @@
+import asyncio
 import logging
 import os
 import requests
 import pytz
 
+from aiohttp import ClientConnectionError, ClientResponseError
 from datetime import datetime, timedelta
 from fast_bitrix24 import Bitrix
+from fast_bitrix24.srh import ServerError
+
+from app.config import resilience_config
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +18,21 @@ logger = logging.getLogger(__name__)
 # Define the recordings directory
 RECORDINGS_DIR = os.path.join('app', 'recordings')
 
+def is_transient_error(exc: Exception) -> bool:
+    """Checks whether an error from Bitrix or the telephony recording host is caused by an outage."""
+    # fast_bitrix24 wraps the last error once its own retries are exhausted
+    while exc is not None:
+        if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                            ClientConnectionError, asyncio.TimeoutError, ServerError)):
+            return True
+        if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+            status = exc.response.status_code
+            return status == 429 or status >= 500
+        if isinstance(exc, ClientResponseError):
+            return exc.status == 429 or exc.status >= 500
+        exc = exc.__cause__
+    return False
+
 class BitrixCallRecorder:
     def __init__(self, webhook_url: str, timezone_str: str = 'Asia/Almaty'):
         self.bx = Bitrix(webhook_url)
@@ -20,22 +40,20 @@ class BitrixCallRecorder:
 
         os.makedirs(RECORDINGS_DIR, exist_ok=True)
 
-    def fetch_call_data(self):
-        """Fetches call data from Bitrix24 for the last 5 minutes."""
+    def fetch_call_data(self, since: str = None):
+        """
+        Fetches call data from Bitrix24 for calls started after `since`,
+        or for the last 5 minutes when no previous fetch is known.
+        """
         try:
-            now = datetime.now(self.timezone)
-            five_minutes_ago = now - timedelta(minutes=5)
-
-            now_str = now.isoformat()
-            five_minutes_ago_str = five_minutes_ago.isoformat()
+            if since is None:
+                since = (datetime.now(self.timezone) - timedelta(minutes=5)).isoformat()
 
-            logger.debug(f"Fetching calls from {five_minutes_ago_str} to {now_str}")
+            logger.debug(f"Fetching calls started after {since}")
 
-            # Fetch call data using the time range for the last 5 minutes
             call_data = self.bx.get_all('voximplant.statistic.get', params={
                 "FILTER": {
-                    ">=CALL_START_DATE": five_minutes_ago_str,
-                    "<CALL_START_DATE": now_str,
+                    ">CALL_START_DATE": since,
                 }
             })
 
@@ -43,18 +61,18 @@ class BitrixCallRecorder:
             return call_data
         except Exception as e:
             logger.error(f"Failed to fetch call data: {e}")
-            return []
+            raise
 
     def download_call_record(self, record_url: str):
         """Загружает запись разговора с указанного URL."""
         try:
-            response = requests.get(record_url)
+            response = requests.get(record_url, timeout=resilience_config.RECORDINGS_TIMEOUT)
             response.raise_for_status()  # Check for HTTP errors
             logger.info(f"Successfully downloaded call record from {record_url}.")
             return response.content
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to download the call record from {record_url}: {e}")
-            return None
+            raise
 
     def save_call_record(self, record_content: bytes, file_name: str):
         """Сохраняет загруженную запись разговора в указанный путь к файлу."""
@@ -63,8 +81,10 @@ class BitrixCallRecorder:
             with open(file_path, "wb") as file:
                 file.write(record_content)
             logger.info(f"Call record saved successfully at {file_path}.")
+            return file_path
         except Exception as e:
             logger.error(f"Failed to save call record: {e}")
+            raise
 
     def get_manager(self, manager_id: str):
         """pass"""
@@ -73,39 +93,29 @@ class BitrixCallRecorder:
         return manager['name']
         
 
-    def process_call_records_btx(self):
-        """Основной метод обработки и сохранения записей звонков."""
-        call_data = self.fetch_call_data()
-
+    def collect_calls(self, call_data: list):
+        """Собирает звонки с записью для дальнейшей обработки по этапам."""
         if not call_data:
             logger.warning("No call records found.")
-            return False
+            return []
 
-        call_details = []
+        calls = []
 
         for call in call_data:
             record_url = call.get('CALL_RECORD_URL')
-            manager = self.get_manager(call.get('PORTAL_USER_ID'))
-            call_duration = call.get('CALL_DURATION')
-            call_details.append({
-                "manager": manager,
-                "call_duration": call_duration
-            })
-            
-
-            if record_url:
-                call_record_content = self.download_call_record(record_url)
-
-                if call_record_content:
-                    # Save the file in the RECORDINGS_DIR with a unique name
-                    file_name = f"call_record_{call['CALL_ID']}.mp3"
-                    self.save_call_record(call_record_content, file_name)
-                else:
-                    logger.warning(f"No content available for call record {call['CALL_ID']}.")
-            else:
+            if not record_url:
                 logger.warning(f"No record URL found for call {call['CALL_ID']}.")
-        
-        return call_details
+                continue
+
+            calls.append({
+                "call_id": call['CALL_ID'],
+                "record_url": record_url,
+                "manager_id": call.get('PORTAL_USER_ID'),
+                "call_duration": call.get('CALL_DURATION'),
+                "file_name": f"call_record_{call['CALL_ID']}.mp3",
+            })
+
+        return calls
 
 
 
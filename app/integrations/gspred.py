@@ -4,12 +4,33 @@ import json
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 import gspread
+import requests
+from google.auth.exceptions import TransportError
+
+from app.config import resilience_config
 
 # Define the scope for Google Sheets API
 SCOPE = ['https://www.googleapis.com/auth/spreadsheets']
 SHEET_ID = os.getenv('GOOGLE_SPREADSHEET_ID')
 CREDENTIALS_FILE = "credentials.json"
 
+def is_transient_error(exc):
+    """
+    Checks whether a Google Sheets error is caused by an outage.
+
+    Args:
+        exc (Exception): The raised error.
+
+    Returns:
+        bool: True for connection errors, timeouts, rate limits and server errors.
+    """
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, TransportError)):
+        return True
+    if isinstance(exc, gspread.exceptions.APIError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
 # Initialize the Google Sheets API client
 def get_google_sheet(sheet_id, credentials_file):
     """
@@ -25,6 +46,7 @@ def get_google_sheet(sheet_id, credentials_file):
     try:
         creds = Credentials.from_service_account_file(credentials_file, scopes=SCOPE)
         client = gspread.authorize(creds)
+        client.set_timeout(resilience_config.SHEETS_TIMEOUT)
         sheet = client.open_by_key(sheet_id).sheet1
         return sheet
     except Exception as e:
@@ -104,4 +126,4 @@ def write_to_google_sheet(data: dict, sheet=None):
     
     except Exception as e:
         logging.error(f"Error writing to Google Sheet: {str(e)}")
-        return None
+        raise
@@ -1,9 +1,11 @@
 import json
 import logging
 import os
+import time
 
-from openai import OpenAI
-from app.integrations.gspred import write_to_google_sheet
+from openai import APIConnectionError, APIStatusError, OpenAI
+
+from app.config import resilience_config
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -11,10 +13,34 @@ logging.basicConfig(level=logging.INFO)
 # Initialize OpenAI client
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, timeout=resilience_config.OPENAI_TIMEOUT, max_retries=0)
+
+# Assistant run statuses that are still in progress
+RUN_PENDING_STATUSES = ("queued", "in_progress", "cancelling")
+
+# Assistant run errors caused by the service rather than by the transcription
+TRANSIENT_RUN_ERRORS = ("server_error", "rate_limit_exceeded", "timeout", "expired")
+
 
-# Define the directory for transcriptions
-TRANSCRIPTIONS_DIR = os.path.join('app', 'transcriptions')
+class AssistantRunError(RuntimeError):
+    """Raised when an assistant run does not complete."""
+
+    def __init__(self, run_id: str, code: str):
+        super().__init__(f"Assistant run {run_id} did not complete: {code}")
+        self.code = code
+
+def is_transient_error(exc: Exception) -> bool:
+    """
+    Check whether an OpenAI error is caused by an outage: connection errors,
+    timeouts, rate limits and server errors.
+    """
+    if isinstance(exc, APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    if isinstance(exc, AssistantRunError):
+        return exc.code in TRANSIENT_RUN_ERRORS
+    return False
 
 def clean_openai_response(response_text: str) -> str:
     """
@@ -51,8 +77,7 @@ def extract_recommendations(response_text: str, call_detail: dict):
         json_part = clean_openai_response(response_text)
         
         if json_part is None:
-            logging.error("Invalid response: No JSON data found.")
-            return None
+            raise ValueError("Invalid response: No JSON data found.")
         
         # Parse the JSON data
         recommendations_data = json.loads(json_part)
@@ -99,63 +124,42 @@ def extract_recommendations(response_text: str, call_detail: dict):
     
     except Exception as e:
         logging.error(f"Error while extracting recommendations: {e}")
-        return None
+        raise ValueError(f"Failed to extract recommendations: {e}") from e
 
-def run_recommendations(call_details: list):
+def request_analysis(transcribed_text: str) -> str:
     """
-    Check all files in the transcriptions directory, use them as 'transcribed text', 
-    and get recommendations from OpenAI assistant.
+    Send the transcribed text to the OpenAI assistant and return its raw response.
+
+    The run is polled for at most OPENAI_TIMEOUT seconds and cancelled afterwards.
     """
-    logging.info("Starting to process transcription files for recommendations.")
-    
-    # Check if the transcriptions directory exists and has files
-    if not os.path.exists(TRANSCRIPTIONS_DIR):
-        logging.error(f"Transcriptions directory '{TRANSCRIPTIONS_DIR}' not found.")
-        raise FileNotFoundError(f"Transcriptions directory '{TRANSCRIPTIONS_DIR}' not found.")
-    
-    transcription_files = [f for f in os.listdir(TRANSCRIPTIONS_DIR) if f.endswith('.txt')]
-    
-    if not transcription_files:
-        logging.error("No transcription files found in the directory.")
-        raise FileNotFoundError("No transcription files found in the directory.")
-    
-    for transcription_file, call_detail in zip(transcription_files, call_details):
-        transcription_path = os.path.join(TRANSCRIPTIONS_DIR, transcription_file)
-        
-        logging.info(f"Processing file: {transcription_file}")
-        
-        # Read the content of the transcription file
-        with open(transcription_path, 'r', encoding='utf-8') as file:
-            transcribed_text = file.read()
-        
-        # Create and run the assistant thread for the transcribed text
-        run = client.beta.threads.create_and_run_poll(
-            assistant_id=OPENAI_ASSISTANT_ID,
-            thread={
-                "messages": [
-                    {"role": "user", "content": transcribed_text}
-                ]
-            }
-        )
-        
-        thread_id = run.thread_id
-        
-        while run.status != "completed":
-            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-        
-        messages = client.beta.threads.messages.list(thread_id=thread_id)
-        openai_response = messages.data[0].content[0].text.value
-        
-        logging.info(f"Received OpenAI response for file: {transcription_file}")
-        
-        # Extract and parse the generated JSON text
-        recommendations = extract_recommendations(openai_response, call_detail)
+    # Create and run the assistant thread for the transcribed text
+    run = client.beta.threads.create_and_run(
+        assistant_id=OPENAI_ASSISTANT_ID,
+        thread={
+            "messages": [
+                {"role": "user", "content": transcribed_text}
+            ]
+        }
+    )
+
+    deadline = time.monotonic() + resilience_config.OPENAI_TIMEOUT
+    while run.status in RUN_PENDING_STATUSES:
+        if time.monotonic() > deadline:
+            try:
+                client.beta.threads.runs.cancel(run_id=run.id, thread_id=run.thread_id)
+            except Exception as e:
+                logging.error(f"Failed to cancel assistant run {run.id}: {e}")
+            raise AssistantRunError(run.id, "timeout")
+        time.sleep(1)
+        run = client.beta.threads.runs.retrieve(run_id=run.id, thread_id=run.thread_id)
+
+    if run.status != "completed":
+        code = run.last_error.code if run.last_error else run.status
+        raise AssistantRunError(run.id, code)
 
-        write_to_google_sheet(recommendations)
+    messages = client.beta.threads.messages.list(thread_id=run.thread_id)
+    openai_response = messages.data[0].content[0].text.value
 
-        try:
-            os.remove(transcription_path)
-            logging.info(f"Successfully deleted file: {transcription_path}")
-        except Exception as e:
-            logging.error(f"Failed to delete file {transcription_path}. Error: {e}")
+    logging.info(f"Received OpenAI response for run: {run.id}")
 
+    return openai_response
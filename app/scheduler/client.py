@@ -0,0 +1,6 @@
+import redis
+
+from app.config import resilience_config
+
+# Shared Redis connection for circuit breaker state, parked calls and the dead-letter queue
+redis_client = redis.Redis.from_url(resilience_config.REDIS_URL, decode_responses=True)
@@ -1,7 +1,8 @@
 import logging
 
 from app.celery_config import celery_app
-from app.scheduler.tasks import process_call_task
+from app.config import resilience_config
+from app.scheduler.tasks import process_call_task, drain_parked_task
 
 @celery_app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
@@ -13,6 +14,12 @@ def setup_periodic_tasks(sender, **kwargs):
         process_call_task.s(),  # Task signature
         name="Process call every 5 minutes"
     )
+
+    sender.add_periodic_task(
+        resilience_config.DRAIN_INTERVAL,
+        drain_parked_task.s(),
+        name="Re-enqueue calls parked by open circuits"
+    )
     # Schedule to run `process_call_records_task` every 24 hours
     # sender.add_periodic_task(
     #     86400.0,  # 86400 seconds = 24 hours
@@ -0,0 +1,150 @@
+import json
+import logging
+from datetime import datetime
+
+from app.celery_config import celery_app
+from app.config import resilience_config
+from app.scheduler.client import redis_client
+from app.scheduler.utils import CLOSED, OPEN
+
+DEAD_LETTER_KEY = "dead_letter"
+FETCH_CURSOR_KEY = "bitrix:last_fetch"
+LOCK_TTL = 60  # seconds, for the drain and replay locks
+
+
+def get_fetch_cursor():
+    """Returns when the last successful Bitrix call fetch started, if any."""
+    return redis_client.get(FETCH_CURSOR_KEY)
+
+
+def set_fetch_cursor(fetch_started: str):
+    """Stores when the last successful Bitrix call fetch started."""
+    redis_client.set(FETCH_CURSOR_KEY, fetch_started)
+
+
+def seen_call_key(call_id: str) -> str:
+    return f"bitrix:seen_call:{call_id}"
+
+
+def mark_call_seen(call_id: str) -> bool:
+    """
+    Marks a fetched call as seen.
+
+    Returns:
+        bool: False if the call was already fetched by an earlier, overlapping fetch.
+    """
+    return bool(redis_client.set(seen_call_key(call_id), 1, nx=True, ex=resilience_config.CALL_DEDUPE_TTL))
+
+
+def forget_calls(call_ids: list):
+    """Unmarks calls so the next fetch picks them up again."""
+    if call_ids:
+        redis_client.delete(*(seen_call_key(call_id) for call_id in call_ids))
+
+
+def parked_key(provider: str) -> str:
+    return f"parked:{provider}"
+
+
+def park_call(provider: str, task_name: str, call: dict):
+    """Parks a call whose provider's circuit is open until the provider recovers."""
+    entry = {"task": task_name, "call": call, "parked_at": datetime.now().isoformat()}
+    redis_client.rpush(parked_key(provider), json.dumps(entry))
+    logging.info(f"Circuit '{provider}' is open, parked call {call.get('call_id')} for {task_name}.")
+
+
+def drain_parked_calls(provider: str, breaker) -> int:
+    """
+    Re-enqueues calls parked for a provider whose breaker is no longer open.
+
+    While the breaker is half-open only one call is released so it can serve as
+    the probe; once closed the backlog is drained in batches of DRAIN_BATCH_SIZE.
+    Each entry is moved to a processing list and only removed from it once it
+    has been sent, so a worker or broker failure can't drop it.
+
+    Returns:
+        int: Number of re-enqueued calls.
+    """
+    state = breaker.state()
+    if state == OPEN:
+        return 0
+
+    key = parked_key(provider)
+    processing_key = f"{key}:processing"
+    lock_key = f"{key}:lock"
+    if not redis_client.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+        return 0
+
+    try:
+        # Put back entries left over by a drain that died before sending them
+        while redis_client.lmove(processing_key, key, "RIGHT", "LEFT") is not None:
+            pass
+
+        limit = resilience_config.DRAIN_BATCH_SIZE if state == CLOSED else 1
+        drained = 0
+        while drained < limit:
+            raw = redis_client.lmove(key, processing_key, "LEFT", "RIGHT")
+            if raw is None:
+                break
+            entry = json.loads(raw)
+            celery_app.send_task(entry["task"], kwargs={"call": entry["call"]})
+            redis_client.lrem(processing_key, 1, raw)
+            drained += 1
+    finally:
+        redis_client.delete(lock_key)
+
+    if drained:
+        logging.info(f"Re-enqueued {drained} parked calls for provider '{provider}'.")
+    return drained
+
+
+def dead_letter_call(task_name: str, call: dict, error: Exception):
+    """Moves a call that exhausted its retries to the dead-letter queue."""
+    entry = {
+        "task": task_name,
+        "call": call,
+        "error": str(error),
+        "failed_at": datetime.now().isoformat(),
+    }
+    redis_client.rpush(DEAD_LETTER_KEY, json.dumps(entry))
+    logging.error(f"Call {call.get('call_id')} moved to dead-letter queue after {task_name} failed: {error}")
+
+
+def replay_dead_letters(task_name: str = None, limit: int = None) -> int:
+    """
+    Re-enqueues calls from the dead-letter queue.
+
+    Each replayed call gets STAGE_MAX_RETRIES retries again for the stage it
+    failed in. Entries are removed only after they have been sent, so a failure
+    midway leaves the rest of the queue intact. Only one replay runs at a time.
+
+    Args:
+        task_name (str, optional): Only replay calls that failed in this task.
+        limit (int, optional): Maximum number of calls to replay.
+
+    Returns:
+        int: Number of replayed calls.
+    """
+    lock_key = f"{DEAD_LETTER_KEY}:lock"
+    if not redis_client.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+        logging.warning("Another dead-letter replay is already running.")
+        return 0
+
+    replayed = 0
+    try:
+        for raw in redis_client.lrange(DEAD_LETTER_KEY, 0, -1):
+            if limit is not None and replayed >= limit:
+                break
+            entry = json.loads(raw)
+            if task_name and entry["task"] != task_name:
+                continue
+            # A replayed call gets a full retry budget for the stage it failed in
+            entry["call"].get("attempts", {}).pop(entry["task"], None)
+            celery_app.send_task(entry["task"], kwargs={"call": entry["call"]})
+            redis_client.lrem(DEAD_LETTER_KEY, 1, raw)
+            replayed += 1
+    finally:
+        redis_client.delete(lock_key)
+
+    logging.info(f"Replayed {replayed} calls from the dead-letter queue.")
+    return replayed
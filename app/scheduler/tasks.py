@@ -1,19 +1,174 @@
 from app.celery_config import celery_app
-from app.crms.bitrix import BitrixCallRecorder
-from app.stt.stt import process_recordings
-from app.openai.utils import run_recommendations
+from app.config import resilience_config
+from app.crms import bitrix
+from app.crms.bitrix import BitrixCallRecorder, RECORDINGS_DIR
+from app.stt.stt import transcribe_audio, save_transcription
+from app.openai import utils as openai_utils
+from app.openai.utils import request_analysis, extract_recommendations
+from app.integrations import gspred
+from app.integrations.gspred import write_to_google_sheet
+from app.scheduler.service import (
+    park_call, dead_letter_call, drain_parked_calls, replay_dead_letters, get_fetch_cursor, set_fetch_cursor,
+    mark_call_seen, forget_calls,
+)
+from app.scheduler.utils import CircuitBreaker, CircuitOpenError, backoff_delay
+from datetime import datetime, timedelta
 import logging
+import os
+
+BITRIX_WEBHOOK_URL = os.getenv("BITRIX_WEBHOOK_URL", "")
+
+# The probe lock has to outlive the whole stage, which may make more than one request
+breakers = {
+    "bitrix": CircuitBreaker("bitrix", bitrix.is_transient_error, probe_ttl=2 * resilience_config.BITRIX_TIMEOUT),
+    # CALL_RECORD_URL points at the telephony provider, not at Bitrix
+    "recordings": CircuitBreaker(
+        "recordings", bitrix.is_transient_error, probe_ttl=2 * resilience_config.RECORDINGS_TIMEOUT,
+    ),
+    "whisper": CircuitBreaker("whisper", openai_utils.is_transient_error, probe_ttl=2 * resilience_config.WHISPER_TIMEOUT),
+    "openai": CircuitBreaker("openai", openai_utils.is_transient_error, probe_ttl=2 * resilience_config.OPENAI_TIMEOUT),
+    "sheets": CircuitBreaker("sheets", gspred.is_transient_error, probe_ttl=2 * resilience_config.SHEETS_TIMEOUT),
+}
+
+
+def run_stage(task, call: dict, stage):
+    """
+    Runs one pipeline stage for a call.
+
+    If the circuit of a provider used by the stage is open, the call is parked
+    for that provider instead of being sent, so workers move on to stages whose
+    providers are healthy. Parking does not use up an attempt, so a long outage
+    does not push calls to the dead-letter queue. Other failures are retried
+    with backoff. Attempts are counted per
+    stage in `call["attempts"]`, which survives parking, and the call is moved
+    to the dead-letter queue once they exceed STAGE_MAX_RETRIES.
+    """
+    try:
+        stage(call)
+    except CircuitOpenError as e:
+        park_call(e.provider, task.name, call)
+    except Exception as e:
+        attempts = call.setdefault("attempts", {})
+        attempts[task.name] = attempts.get(task.name, 0) + 1
+        if attempts[task.name] > resilience_config.STAGE_MAX_RETRIES:
+            dead_letter_call(task.name, call, e)
+            return
+        countdown = backoff_delay(attempts[task.name] - 1)
+        logging.warning(f"{task.name} failed for call {call.get('call_id')}, retrying in {countdown:.0f}s: {e}")
+        # The retry must not inherit the positional args of the original request
+        raise task.retry(exc=e, countdown=countdown, args=(), kwargs={"call": call})
+
+
+def _download_call(call: dict):
+    recorder = BitrixCallRecorder(BITRIX_WEBHOOK_URL)
+    with breakers["bitrix"]:
+        call["manager"] = recorder.get_manager(call["manager_id"])
+    with breakers["recordings"]:
+        record_content = recorder.download_call_record(call["record_url"])
+    recorder.save_call_record(record_content, call["file_name"])
+    transcribe_call_task.delay(call=call)
+
+
+def _transcribe_call(call: dict):
+    audio_path = os.path.abspath(os.path.join(RECORDINGS_DIR, call["file_name"]))
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"File not found: {audio_path}")
+
+    with breakers["whisper"]:
+        transcription = transcribe_audio(audio_path)
+    call["transcription_path"] = save_transcription(audio_path, transcription)
+    analyze_call_task.delay(call=call)
+
+
+def _analyze_call(call: dict):
+    transcription_path = call["transcription_path"]
+    with open(transcription_path, 'r', encoding='utf-8') as file:
+        transcribed_text = file.read()
+
+    with breakers["openai"]:
+        openai_response = request_analysis(transcribed_text)
+    call["recommendations"] = extract_recommendations(openai_response, call)
+
+    # The recommendations travel with the call from here on
+    try:
+        os.remove(transcription_path)
+        logging.info(f"Successfully deleted file: {transcription_path}")
+    except Exception as e:
+        logging.error(f"Failed to delete file {transcription_path}. Error: {e}")
+
+    write_sheet_task.delay(call=call)
+
+
+def _write_call(call: dict):
+    with breakers["sheets"]:
+        write_to_google_sheet(call["recommendations"])
+
 
 @celery_app.task
 def process_call_task():
-    webhook = ""
-    recorder = BitrixCallRecorder(webhook)
-    call_details = recorder.process_call_records_btx()
-    logging.debug(call_details)
-    if not call_details:   
+    recorder = BitrixCallRecorder(BITRIX_WEBHOOK_URL)
+
+    # A call that had not ended when the last fetch started began at most
+    # CALL_FETCH_OVERLAP before it, so look back that far and skip calls already seen
+    fetch_started = datetime.now(recorder.timezone)
+    cursor = get_fetch_cursor()
+    since = None
+    if cursor:
+        since = (datetime.fromisoformat(cursor) - timedelta(seconds=resilience_config.CALL_FETCH_OVERLAP)).isoformat()
+
+    try:
+        with breakers["bitrix"]:
+            call_data = recorder.fetch_call_data(since)
+    except CircuitOpenError:
+        # The cursor is not moved, so the next run picks up the calls from this one
+        logging.info("Circuit 'bitrix' is open, skipping call fetch.")
         return
-    process_recordings()
-    run_recommendations(call_details)
+
+    new_call_data = [call for call in call_data if mark_call_seen(call['CALL_ID'])]
+    enqueued = set()
+    try:
+        for call in recorder.collect_calls(new_call_data):
+            download_call_task.delay(call=call)
+            enqueued.add(call["call_id"])
+    except Exception:
+        forget_calls([call['CALL_ID'] for call in new_call_data if call['CALL_ID'] not in enqueued])
+        raise
+
+    logging.debug(f"Enqueued {len(enqueued)} new calls.")
+    set_fetch_cursor(fetch_started.isoformat())
+
+
+@celery_app.task(bind=True, max_retries=None)  # retries are counted by run_stage
+def download_call_task(self, call: dict):
+    run_stage(self, call, _download_call)
+
+
+@celery_app.task(bind=True, max_retries=None)  # retries are counted by run_stage
+def transcribe_call_task(self, call: dict):
+    run_stage(self, call, _transcribe_call)
+
+
+@celery_app.task(bind=True, max_retries=None)  # retries are counted by run_stage
+def analyze_call_task(self, call: dict):
+    run_stage(self, call, _analyze_call)
+
+
+@celery_app.task(bind=True, max_retries=None)  # retries are counted by run_stage
+def write_sheet_task(self, call: dict):
+    run_stage(self, call, _write_call)
+
+
+@celery_app.task
+def drain_parked_task():
+    """Re-enqueues parked calls for every provider that has recovered."""
+    for provider, breaker in breakers.items():
+        drain_parked_calls(provider, breaker)
+
+
+@celery_app.task
+def replay_dead_letters_task(task_name: str = None, limit: int = None):
+    """Bulk replay of the dead-letter queue, optionally filtered by stage task name."""
+    return replay_dead_letters(task_name, limit)
 
 
 # @celery_app.task
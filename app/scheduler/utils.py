@@ -0,0 +1,118 @@
+import logging
+import math
+import random
+import time
+
+from app.config import resilience_config
+from app.scheduler.client import redis_client
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a provider is called while its circuit is open, or is still down when probed."""
+
+    def __init__(self, provider: str):
+        super().__init__(f"Circuit '{provider}' is open.")
+        self.provider = provider
+
+
+class CircuitBreaker:
+    """
+    Redis-backed circuit breaker shared by all Celery workers.
+
+    After `failure_threshold` consecutive transient failures the breaker opens
+    and requests to the provider are refused. Once `recovery_timeout` seconds
+    have passed the breaker is half-open: a single probe request is let through,
+    and its outcome either closes the breaker or opens it again. The probe lock
+    expires after `probe_ttl` seconds in case the probing worker dies.
+
+    Use it as a context manager around the provider call itself. Entering raises
+    CircuitOpenError while the circuit is open, and a transient error from a
+    request made while the circuit is not closed (e.g. a failed probe) is turned
+    into CircuitOpenError as well. Errors for which `is_transient` returns False
+    (e.g. a 404 for one recording) mean the provider answered, so they do not
+    count as failures:
+
+        with breakers["whisper"]:
+            text = transcribe_audio(path)
+    """
+
+    def __init__(self, name: str, is_transient=None, probe_ttl: float = None,
+                 failure_threshold: int = None, recovery_timeout: int = None, client=redis_client):
+        self.name = name
+        self.is_transient = is_transient or (lambda exc: True)
+        self.failure_threshold = failure_threshold or resilience_config.CIRCUIT_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or resilience_config.CIRCUIT_RECOVERY_TIMEOUT
+        self.probe_ttl = probe_ttl or self.recovery_timeout
+        self.redis = client
+        self.key = f"circuit:{name}"
+        self.probe_key = f"circuit:{name}:probe"
+
+    def state(self) -> str:
+        """Returns the current state of the breaker."""
+        opened_at = self.redis.hget(self.key, "opened_at")
+        if opened_at is None:
+            return CLOSED
+        if time.time() - float(opened_at) < self.recovery_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def allow_request(self) -> bool:
+        """Checks whether a request to the provider may be made right now."""
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            # Only one worker gets to probe the provider
+            return bool(self.redis.set(self.probe_key, 1, nx=True, ex=int(math.ceil(self.probe_ttl))))
+        return False
+
+    def record_success(self):
+        """Closes the breaker and resets the failure counter."""
+        failures, opened_at = self.redis.hmget(self.key, "failures", "opened_at")
+        if failures is None and opened_at is None:
+            return
+        self.redis.delete(self.key, self.probe_key)
+        if opened_at is not None:
+            logging.info(f"Circuit '{self.name}' closed.")
+
+    def record_failure(self):
+        """Counts a failure and opens the breaker when the threshold is reached."""
+        failures = self.redis.hincrby(self.key, "failures", 1)
+        state = self.state()
+        if state == HALF_OPEN or (state == CLOSED and failures >= self.failure_threshold):
+            self.redis.hset(self.key, "opened_at", time.time())
+            self.redis.delete(self.probe_key)
+            logging.warning(f"Circuit '{self.name}' opened after {failures} consecutive failures.")
+
+    def __enter__(self):
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not self.is_transient(exc_value):
+            self.record_success()
+            return False
+
+        state = self.state()
+        self.record_failure()
+        if state != CLOSED:
+            # The provider is still down, which says nothing about this call
+            raise CircuitOpenError(self.name) from exc_value
+        return False
+
+
+def backoff_delay(retries: int) -> float:
+    """
+    Returns the countdown in seconds before the next retry.
+
+    Exponential backoff capped at RETRY_BACKOFF_MAX, with half of the delay
+    randomised so that retries of calls that failed together spread out.
+    """
+    delay = min(resilience_config.RETRY_BACKOFF_MAX, resilience_config.RETRY_BACKOFF_BASE * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
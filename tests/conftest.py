@@ -0,0 +1,149 @@
+import os
+
+# The OpenAI clients are created on import and need an API key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+
+import app.celery_config  # noqa: F401  (loads the scheduler modules in the same order as the worker)
+from app.scheduler import service, tasks, utils
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis.Redis used by the scheduler."""
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.data = {}
+        self.expires = {}
+        self.commands = []
+
+    def _get(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= self.clock.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _list(self, key):
+        return self.data.setdefault(key, [])
+
+    def get(self, key):
+        return self._get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        self.commands.append("set")
+        if nx and self._get(key) is not None:
+            return None
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.clock.time() + ex
+        return True
+
+    def delete(self, *keys):
+        self.commands.append("delete")
+        deleted = 0
+        for key in keys:
+            if self._get(key) is not None:
+                deleted += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+    def hget(self, key, field):
+        return (self._get(key) or {}).get(field)
+
+    def hmget(self, key, *fields):
+        values = self._get(key) or {}
+        return [values.get(field) for field in fields]
+
+    def hset(self, key, field, value):
+        self.commands.append("hset")
+        self.data.setdefault(key, {})[field] = str(value)
+
+    def hincrby(self, key, field, amount=1):
+        self.commands.append("hincrby")
+        values = self.data.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+        return int(values[field])
+
+    def rpush(self, key, value):
+        self._list(key).append(value)
+        return len(self.data[key])
+
+    def llen(self, key):
+        return len(self._get(key) or [])
+
+    def lrange(self, key, start, end):
+        values = self._get(key) or []
+        return list(values[start:] if end == -1 else values[start:end + 1])
+
+    def lrem(self, key, count, value):
+        values = self._get(key) or []
+        if value in values:
+            values.remove(value)
+            return 1
+        return 0
+
+    def lmove(self, source, destination, src, dest):
+        values = self._get(source)
+        if not values:
+            return None
+        value = values.pop(0 if src == "LEFT" else -1)
+        target = self._list(destination)
+        if dest == "LEFT":
+            target.insert(0, value)
+        else:
+            target.append(value)
+        return value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(utils, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def fake_redis(clock, monkeypatch):
+    fake = FakeRedis(clock)
+    monkeypatch.setattr(service, "redis_client", fake)
+    return fake
+
+
+@pytest.fixture
+def sent_tasks(monkeypatch):
+    """Captures tasks re-enqueued through celery_app.send_task."""
+    sent = []
+    monkeypatch.setattr(service.celery_app, "send_task", lambda name, kwargs: sent.append((name, kwargs)))
+    return sent
+
+
+@pytest.fixture
+def make_breaker(fake_redis):
+    def make_breaker(name="test", **kwargs):
+        kwargs.setdefault("failure_threshold", 2)
+        kwargs.setdefault("recovery_timeout", 60)
+        return utils.CircuitBreaker(name, client=fake_redis, **kwargs)
+    return make_breaker
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    """Replaces the task breaker registry; fill it with breakers from make_breaker."""
+    registry = {}
+    monkeypatch.setattr(tasks, "breakers", registry)
+    return registry
@@ -0,0 +1,109 @@
+import pytest
+
+from app.config import resilience_config
+from app.scheduler.utils import CLOSED, HALF_OPEN, OPEN, CircuitOpenError, backoff_delay
+
+
+class Outage(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def fail(breaker, exc_type=Outage):
+    with pytest.raises(exc_type):
+        with breaker:
+            raise exc_type()
+
+
+def is_outage(exc):
+    return isinstance(exc, Outage)
+
+
+def test_breaker_opens_half_opens_and_closes_again(make_breaker, clock):
+    breaker = make_breaker(failure_threshold=2, recovery_timeout=60)
+
+    fail(breaker)
+    assert breaker.state() == CLOSED
+    fail(breaker)
+    assert breaker.state() == OPEN
+    with pytest.raises(CircuitOpenError):
+        with breaker:
+            pass
+
+    clock.advance(61)
+    assert breaker.state() == HALF_OPEN
+    with breaker:
+        pass
+    assert breaker.state() == CLOSED
+    assert breaker.allow_request()
+
+
+def test_failed_probe_reopens_the_breaker(make_breaker, clock):
+    breaker = make_breaker(failure_threshold=2, recovery_timeout=60)
+    fail(breaker)
+    fail(breaker)
+
+    clock.advance(61)
+    with pytest.raises(CircuitOpenError) as error:
+        with breaker:
+            raise Outage()
+    assert isinstance(error.value.__cause__, Outage)
+    assert breaker.state() == OPEN
+
+
+def test_half_open_breaker_admits_a_single_probe(make_breaker, clock):
+    breaker = make_breaker(failure_threshold=1, recovery_timeout=60, probe_ttl=600)
+    fail(breaker)
+    clock.advance(61)
+
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # The probe lock outlives the recovery timeout, so a slow probe is not joined by a second one
+    clock.advance(120)
+    assert not breaker.allow_request()
+
+    # ...but it expires if the probing worker died
+    clock.advance(600)
+    assert breaker.allow_request()
+
+
+def test_non_transient_errors_do_not_open_the_breaker(make_breaker):
+    breaker = make_breaker(is_transient=is_outage, failure_threshold=2)
+
+    for _ in range(5):
+        fail(breaker, BadRequest)
+    assert breaker.state() == CLOSED
+
+
+def test_non_transient_error_from_probe_closes_the_breaker(make_breaker, clock):
+    breaker = make_breaker(is_transient=is_outage, failure_threshold=1, recovery_timeout=60)
+    fail(breaker)
+    clock.advance(61)
+
+    fail(breaker, BadRequest)
+    assert breaker.state() == CLOSED
+
+
+def test_success_on_clean_breaker_does_not_write(make_breaker, fake_redis):
+    breaker = make_breaker()
+
+    with breaker:
+        pass
+    assert fake_redis.commands == []
+
+    fail(breaker)
+    with breaker:
+        pass
+    assert fake_redis.commands == ["hincrby", "delete"]
+    assert fake_redis.hget(breaker.key, "failures") is None
+
+
+@pytest.mark.parametrize("retries", range(10))
+def test_backoff_delay_is_bounded(retries):
+    delay = min(resilience_config.RETRY_BACKOFF_MAX, resilience_config.RETRY_BACKOFF_BASE * 2 ** retries)
+    for _ in range(50):
+        assert delay / 2 <= backoff_delay(retries) <= delay
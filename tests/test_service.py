@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from app.scheduler import service
+
+
+def dead_letter(task_name, call_id):
+    service.dead_letter_call(task_name, {"call_id": call_id}, Exception("boom"))
+
+
+def test_replay_dead_letters_filters_by_task_name(fake_redis, sent_tasks):
+    dead_letter("write_sheet_task", "1")
+    dead_letter("analyze_call_task", "2")
+    dead_letter("write_sheet_task", "3")
+
+    assert service.replay_dead_letters("write_sheet_task") == 2
+    assert [kwargs["call"]["call_id"] for _, kwargs in sent_tasks] == ["1", "3"]
+    remaining = [json.loads(raw)["call"]["call_id"] for raw in fake_redis.lrange(service.DEAD_LETTER_KEY, 0, -1)]
+    assert remaining == ["2"]
+
+
+def test_replay_dead_letters_respects_limit(fake_redis, sent_tasks):
+    for call_id in "1234":
+        dead_letter("write_sheet_task", call_id)
+
+    assert service.replay_dead_letters(limit=2) == 2
+    assert [kwargs["call"]["call_id"] for _, kwargs in sent_tasks] == ["1", "2"]
+    assert fake_redis.llen(service.DEAD_LETTER_KEY) == 2
+
+
+def test_replay_resets_attempts_of_the_failed_stage(fake_redis, sent_tasks):
+    call = {"call_id": "1", "attempts": {"download_call_task": 2, "write_sheet_task": 6}}
+    service.dead_letter_call("write_sheet_task", call, Exception("boom"))
+
+    service.replay_dead_letters()
+    [(_, kwargs)] = sent_tasks
+    assert kwargs["call"]["attempts"] == {"download_call_task": 2}
+
+
+def test_replay_keeps_entries_when_sending_fails(fake_redis, monkeypatch):
+    dead_letter("write_sheet_task", "1")
+
+    def broker_down(name, kwargs):
+        raise ConnectionError("broker unavailable")
+    monkeypatch.setattr(service.celery_app, "send_task", broker_down)
+
+    with pytest.raises(ConnectionError):
+        service.replay_dead_letters()
+    assert fake_redis.llen(service.DEAD_LETTER_KEY) == 1
+
+
+def test_drain_skips_open_breaker(make_breaker, sent_tasks):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure()
+    service.park_call("test", "write_sheet_task", {"call_id": "1"})
+
+    assert service.drain_parked_calls("test", breaker) == 0
+    assert sent_tasks == []
+
+
+def test_drain_releases_one_probe_when_half_open(make_breaker, clock, sent_tasks):
+    breaker = make_breaker(failure_threshold=1, recovery_timeout=60)
+    breaker.record_failure()
+    for call_id in "123":
+        service.park_call("test", "write_sheet_task", {"call_id": call_id})
+
+    clock.advance(61)
+    assert service.drain_parked_calls("test", breaker) == 1
+
+    breaker.record_success()
+    assert service.drain_parked_calls("test", breaker) == 2
+    assert [kwargs["call"]["call_id"] for _, kwargs in sent_tasks] == ["1", "2", "3"]
+
+
+def test_drain_keeps_entries_when_sending_fails(make_breaker, fake_redis, sent_tasks, monkeypatch):
+    breaker = make_breaker()
+    service.park_call("test", "write_sheet_task", {"call_id": "1"})
+
+    def broker_down(name, kwargs):
+        raise ConnectionError("broker unavailable")
+    monkeypatch.setattr(service.celery_app, "send_task", broker_down)
+    with pytest.raises(ConnectionError):
+        service.drain_parked_calls("test", breaker)
+
+    monkeypatch.setattr(service.celery_app, "send_task", lambda name, kwargs: sent_tasks.append((name, kwargs)))
+    assert service.drain_parked_calls("test", breaker) == 1
+    assert fake_redis.llen(service.parked_key("test")) == 0
+    assert fake_redis.llen(f"{service.parked_key('test')}:processing") == 0
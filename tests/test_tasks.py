@@ -0,0 +1,281 @@
+import inspect
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from celery.canvas import Signature
+from celery.exceptions import Retry
+
+from app.config import resilience_config
+from app.crms.bitrix import BitrixCallRecorder
+from app.scheduler import service, tasks
+from app.scheduler.utils import CLOSED, HALF_OPEN
+
+TASK_NAME = "app.scheduler.tasks.write_sheet_task"
+MAX_ATTEMPTS = resilience_config.STAGE_MAX_RETRIES + 1
+
+
+class Outage(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Retried(Exception):
+    def __init__(self, call):
+        self.call = call
+
+
+def stage_task(call):
+    """Signature of the stage tasks, without the bound task."""
+    return call
+
+
+class FakeTask:
+    """
+    Stands in for a bound Celery task; retry() hands the call back to the test.
+
+    Like Celery's Task.retry, args and kwargs left as None fall back to those of
+    the current request, which holds the call positionally.
+    """
+    name = TASK_NAME
+
+    def __init__(self, call):
+        self.request_args = (call,)
+
+    def retry(self, exc, countdown, args=None, kwargs=None):
+        args = self.request_args if args is None else args
+        return Retried(stage_task(*args, **(kwargs or {})))
+
+
+def failing_stage(exc_type):
+    def stage(call):
+        with tasks.breakers["test"]:
+            raise exc_type()
+    return stage
+
+
+def healthy_stage(call):
+    with tasks.breakers["test"]:
+        call["done"] = True
+
+
+def run_worker(calls, stage, clock, sent_tasks, rounds=50):
+    """
+    Runs calls through run_stage the way the worker would: retries are executed
+    right away, and between rounds the clock moves past the recovery timeout and
+    parked calls are drained. Returns the calls drained in the last round that
+    have not been run yet.
+    """
+    queue = list(calls)
+    for _ in range(rounds):
+        while queue:
+            call = queue.pop(0)
+            try:
+                tasks.run_stage(FakeTask(call), call, stage)
+            except Retried as retried:
+                # Celery serializes the retried call, like parking does
+                queue.append(json.loads(json.dumps(retried.call)))
+        clock.advance(61)
+        service.drain_parked_calls("test", tasks.breakers["test"])
+        queue.extend(kwargs["call"] for _, kwargs in sent_tasks)
+        sent_tasks.clear()
+        if not queue:
+            break
+    return queue
+
+
+def dead_letters(fake_redis):
+    return [json.loads(raw) for raw in fake_redis.lrange(service.DEAD_LETTER_KEY, 0, -1)]
+
+
+def test_non_transient_errors_are_dead_lettered_without_opening_the_circuit(
+        make_breaker, breakers, fake_redis, clock, sent_tasks):
+    breakers["test"] = make_breaker(is_transient=lambda exc: isinstance(exc, Outage))
+
+    run_worker([{"call_id": "poison"}], failing_stage(BadRequest), clock, sent_tasks)
+
+    [entry] = dead_letters(fake_redis)
+    assert entry["call"]["attempts"] == {TASK_NAME: MAX_ATTEMPTS}
+    assert breakers["test"].state() == CLOSED
+
+    healthy_call = {"call_id": "healthy"}
+    tasks.run_stage(FakeTask(healthy_call), healthy_call, healthy_stage)
+    assert healthy_call["done"]
+
+
+def test_parked_calls_survive_a_long_outage(make_breaker, breakers, fake_redis, clock, sent_tasks):
+    # Each drained call probes the provider while it is down. Those failures must
+    # not use up the calls' attempts, or the backlog ends up dead-lettered.
+    breakers["test"] = make_breaker(failure_threshold=2, recovery_timeout=60)
+    calls = [{"call_id": call_id} for call_id in "123"]
+
+    in_flight = run_worker(calls, failing_stage(Outage), clock, sent_tasks, rounds=30)
+
+    assert dead_letters(fake_redis) == []
+    parked = [json.loads(raw)["call"] for raw in fake_redis.lrange(service.parked_key("test"), 0, -1)]
+    backlog = parked + in_flight
+    assert sorted(call["call_id"] for call in backlog) == ["1", "2", "3"]
+    assert all(call.get("attempts", {}).get(TASK_NAME, 0) <= resilience_config.STAGE_MAX_RETRIES for call in backlog)
+
+    # Recovery drains the backlog automatically
+    run_worker(in_flight, healthy_stage, clock, sent_tasks)
+    assert fake_redis.llen(service.parked_key("test")) == 0
+    assert dead_letters(fake_redis) == []
+    assert breakers["test"].state() == CLOSED
+
+
+def test_transient_failures_count_while_the_circuit_is_closed(make_breaker, breakers, fake_redis, clock, sent_tasks):
+    # A call that keeps failing while other calls succeed uses up its attempts
+    breakers["test"] = make_breaker(failure_threshold=2)
+
+    def flaky_for_one_call(call):
+        with tasks.breakers["test"]:
+            if call["call_id"] == "poison":
+                raise Outage()
+
+    call = {"call_id": "poison"}
+    while not dead_letters(fake_redis):
+        try:
+            tasks.run_stage(FakeTask(call), call, flaky_for_one_call)
+        except Retried as retried:
+            call = retried.call
+        healthy_call = {"call_id": "healthy"}
+        tasks.run_stage(FakeTask(healthy_call), healthy_call, flaky_for_one_call)
+
+    [entry] = dead_letters(fake_redis)
+    assert entry["call"]["attempts"] == {TASK_NAME: MAX_ATTEMPTS}
+    assert breakers["test"].state() == CLOSED
+
+
+def test_calls_parked_while_circuit_is_open_keep_their_attempts(
+        make_breaker, breakers, fake_redis, clock, sent_tasks):
+    breakers["test"] = make_breaker(failure_threshold=1)
+    breakers["test"].record_failure()
+
+    call = {"call_id": "1", "attempts": {TASK_NAME: 2}}
+    tasks.run_stage(FakeTask(call), call, healthy_stage)
+
+    [raw] = fake_redis.lrange(service.parked_key("test"), 0, -1)
+    assert json.loads(raw)["call"]["attempts"] == {TASK_NAME: 2}
+
+
+def test_stage_failing_before_provider_call_does_not_hold_the_probe(
+        make_breaker, breakers, clock):
+    breakers["test"] = make_breaker(failure_threshold=1, recovery_timeout=60)
+    breakers["test"].record_failure()
+    clock.advance(61)
+
+    def missing_file(call):
+        raise FileNotFoundError("recording is gone")
+        with tasks.breakers["test"]:
+            pass
+
+    call = {"call_id": "1"}
+    try:
+        tasks.run_stage(FakeTask(call), call, missing_file)
+    except Retried:
+        pass
+
+    assert breakers["test"].state() == HALF_OPEN
+    assert breakers["test"].allow_request()
+
+
+def test_retry_of_positionally_dispatched_stage_passes_call_once(monkeypatch):
+    retried = []
+    monkeypatch.setattr(Signature, "apply_async", lambda self, *args, **kwargs: retried.append(self))
+
+    def bad_response(call):
+        raise ValueError("unparseable response")
+
+    call = {"call_id": "1"}
+    task = tasks.transcribe_call_task
+    # A stage started with .delay(call) carries the call in request.args
+    task.push_request(id="1", args=(call,), kwargs={}, retries=0, called_directly=False)
+    try:
+        with pytest.raises(Retry):
+            tasks.run_stage(task, call, bad_response)
+    finally:
+        task.pop_request()
+
+    [signature] = retried
+    assert signature.args == ()
+    bound = inspect.signature(task.run).bind(*signature.args, **signature.kwargs)
+    assert bound.arguments["call"]["attempts"] == {task.name: 1}
+
+
+def test_call_is_parked_for_the_provider_whose_circuit_is_open(make_breaker, breakers, fake_redis, sent_tasks):
+    breakers["bitrix"] = make_breaker("bitrix")
+    breakers["recordings"] = make_breaker("recordings", failure_threshold=1)
+    breakers["recordings"].record_failure()
+
+    def download(call):
+        with tasks.breakers["bitrix"]:
+            call["manager"] = "Manager"
+        with tasks.breakers["recordings"]:
+            call["done"] = True
+
+    call = {"call_id": "1"}
+    tasks.run_stage(FakeTask(call), call, download)
+
+    assert fake_redis.llen(service.parked_key("recordings")) == 1
+    assert fake_redis.llen(service.parked_key("bitrix")) == 0
+    assert breakers["bitrix"].state() == CLOSED
+
+
+class FakeRecorder(BitrixCallRecorder):
+    """Serves call listings from `listings` instead of Bitrix."""
+    listings = []
+    fetches = []
+
+    def __init__(self, webhook_url):
+        self.timezone = pytz.timezone('Asia/Almaty')
+
+    def fetch_call_data(self, since=None):
+        self.fetches.append(since)
+        return self.listings.pop(0)
+
+
+def bitrix_call(call_id):
+    return {"CALL_ID": call_id, "CALL_RECORD_URL": f"https://pbx/{call_id}", "CALL_START_DATE": "2024-06-26T09:47:15+05:00"}
+
+
+@pytest.fixture
+def fetch(monkeypatch, make_breaker, breakers):
+    breakers["bitrix"] = make_breaker("bitrix")
+    enqueued = []
+    monkeypatch.setattr(tasks, "BitrixCallRecorder", FakeRecorder)
+    monkeypatch.setattr(FakeRecorder, "fetches", [])
+    monkeypatch.setattr(tasks.download_call_task, "delay", lambda call: enqueued.append(call["call_id"]))
+
+    def fetch(*listing):
+        FakeRecorder.listings = [list(listing)]
+        tasks.process_call_task()
+        return enqueued
+    return fetch
+
+
+def test_fetch_looks_back_from_the_last_fetch_and_skips_seen_calls(fetch, fake_redis):
+    assert fetch(bitrix_call("A")) == ["A"]
+    assert FakeRecorder.fetches == [None]
+
+    # The overlapping fetch returns A again, together with a longer call B that ended later
+    last_fetch = datetime.fromisoformat(service.get_fetch_cursor())
+    assert fetch(bitrix_call("A"), bitrix_call("B")) == ["A", "B"]
+    overlap = timedelta(seconds=resilience_config.CALL_FETCH_OVERLAP)
+    assert datetime.fromisoformat(FakeRecorder.fetches[1]) == last_fetch - overlap
+
+
+def test_calls_that_failed_to_enqueue_are_fetched_again(fetch, fake_redis, monkeypatch):
+    def broker_down(call):
+        raise ConnectionError("broker unavailable")
+    monkeypatch.setattr(tasks.download_call_task, "delay", broker_down)
+
+    with pytest.raises(ConnectionError):
+        fetch(bitrix_call("A"))
+    assert service.get_fetch_cursor() is None
+    # A is not marked as seen any more, so the next fetch enqueues it
+    assert service.mark_call_seen("A")